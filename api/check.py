@@ -1,15 +1,40 @@
 from http.server import BaseHTTPRequestHandler
-import os, json, requests, psycopg2, datetime, time
+import os, requests, datetime, time, threading
+import orjson
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from urllib.parse import urlparse, parse_qs
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import html
+import logging
+import sys
 
 # ==================================
 # 🔧 CONFIGURATION
 # ==================================
-PINCODES_TO_CHECK = str(os.getenv("PINCODES_TO_CHECK"))
-PINCODES_TO_CHECK = PINCODES_TO_CHECK.split(",") 
-print(f"[config] Pincodes to check: {PINCODES_TO_CHECK}")
+# Log lines keep their "[tag]" prefixes and go to stdout as plain messages. A dedicated
+# handler (not basicConfig) so output doesn't depend on how the runtime set up the root logger;
+# each record is written whole, so lines from concurrent checks don't interleave.
+log = logging.getLogger("check")
+if not log.handlers:
+    _log_handler = logging.StreamHandler(sys.stdout)
+    _log_handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_log_handler)
+    log.propagate = False
+# An unrecognised LOG_LEVEL (e.g. "verbose") falls back to INFO instead of failing the import
+_log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+log.setLevel(_log_level if isinstance(logging.getLevelName(_log_level), int) else logging.INFO)
+
+# Normalized once at import: stripped, empties dropped, and frozen since every check shares it
+PINCODES_TO_CHECK = tuple(
+    pincode.strip() for pincode in (os.getenv("PINCODES_TO_CHECK") or "").split(",") if pincode.strip()
+)
+if not PINCODES_TO_CHECK:
+    raise Exception("PINCODES_TO_CHECK environment variable is not set.")
+log.info("[config] Pincodes to check: %s", PINCODES_TO_CHECK)
 # DATABASE_URL: Used for psycopg2 connection
 DATABASE_URL = os.getenv("DIRECT_URL")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -27,47 +52,199 @@ LICENSE_KEY = os.getenv("LICENSE_KEY")
 MIN_REFRESH_INTERVAL_DAYS = 3 
 # The duration (in months) to extend the local license if the server says it's OK.
 LICENSE_EXTENSION_MONTHS = 1
+# How long (in seconds) a warm process trusts its in-memory copy before re-reading the DB.
+LICENSE_MEMORY_CACHE_SECONDS = 3600
 
 # Flipkart Proxy (AlwaysData)
 FLIPKART_PROXY_URL = "https://rknldeals.alwaysdata.net/flipkart_check"
 
+# --- PRODUCT SCHEDULING CONFIG ---
+# Only re-check products whose last check is older than this many minutes.
+# 0 (default) checks every product on every run.
+RECHECK_INTERVAL_MINUTES = int(os.getenv("RECHECK_INTERVAL_MINUTES", "0"))
+# Max number of (stalest-first) products per run when RECHECK_INTERVAL_MINUTES is set.
+RECHECK_BATCH_SIZE = int(os.getenv("RECHECK_BATCH_SIZE", "50"))
+# How long (in seconds) a warm process reuses the product list before re-querying the DB.
+# Ignored when RECHECK_INTERVAL_MINUTES is set, since that query changes every run.
+PRODUCTS_CACHE_SECONDS = int(os.getenv("PRODUCTS_CACHE_SECONDS", "600"))
+
+# --- RESULT CACHE CONFIG ---
+# How long (in seconds) a warm process reuses a check result for the same product/pincode.
+# Smooths over overlapping cron runs and retries; bypass per request with ?nocache=1.
+STOCK_CACHE_SECONDS = int(os.getenv("STOCK_CACHE_SECONDS", "120"))
+
+# --- CONCURRENCY CONFIG ---
+# Upper bound on any one store's worker pool (see STORE_CONCURRENCY). The checks are network-bound,
+# so a run takes roughly as long as the slowest store's queue instead of the sum of all checks.
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "16"))
+# Wall-clock budget for one run. Checks still in flight when it runs out are reported as
+# unavailable, so one hung host can't hold the cron call past the platform's time limit.
+RUN_BUDGET_SECONDS = float(os.getenv("RUN_BUDGET_SECONDS", "50"))
+# Connect timeout for every outbound request; the per-call value is the read timeout.
+# Slightly over 3s so a single dropped SYN still gets its retransmit.
+CONNECT_TIMEOUT = 3.05
+# Max requests in flight per store, so the fan-out doesn't trip rate limits / connection resets.
+# Each store gets its own pool of this size, so a long queue for one store (e.g. many Amazon
+# pages) waits behind itself instead of tying up threads the other stores need.
+STORE_CONCURRENCY = {
+    "croma": 5,
+    "flipkart": 5,
+    "amazon": 3,
+    "unicorn": 5,
+    "iqoo": 5,
+    "vivo": 5,
+    "reliance_digital": 5,
+}
+
+# ==================================
+# 🌐 HTTP SESSION
+# ==================================
+# One keep-alive session for every outbound call, so repeat hits to the same host
+# (store APIs, Telegram, license server) reuse the TLS connection.
+SESSION = requests.Session()
+_SESSION_ADAPTER = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=2,
+        # A read timeout already cost the full read budget (up to 25s for the Flipkart proxy);
+        # repeating it can't finish inside RUN_BUDGET_SECONDS, so only connects/statuses retry
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # Store/proxy POSTs are read-only stock queries, so a flaky one is safe to repeat
+        allowed_methods=frozenset({"GET", "POST"}),
+        # Back off by our own short schedule on 429/503: an uncapped Retry-After sleep would hold
+        # the store's semaphore slot, and with wait=False shutdown outlive the run into later ones
+        respect_retry_after_header=False,
+        # Hand the last response back instead of raising, so callers keep their status handling
+        raise_on_status=False,
+    ),
+)
+# Plain http too: FLIPKART_PROXY_URL / LICENSE_SERVER_URL come from env and may not be TLS
+SESSION.mount("https://", _SESSION_ADAPTER)
+SESSION.mount("http://", _SESSION_ADAPTER)
+# Request bodies are serialized with orjson and sent as data=, bypassing requests' stdlib json=
+# encoder; calls without their own store headers pass this for the content type.
+JSON_HEADERS = {"content-type": "application/json"}
+# sendMessage is not idempotent: a retried POST whose first attempt did land would double-post the alert
+SESSION.mount("https://api.telegram.org/", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+# Accept-Encoding is left to requests: with brotli installed it offers "gzip, deflate, br",
+# which shrinks the Amazon/Vivo HTML considerably over the wire.
+# Store pages reject the python-requests UA, so every request goes out as desktop Chrome
+SESSION.headers.update({
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/137.0.0.0 Safari/537.36"
+    ),
+})
+
+# Upstream calls made during the current run: key -> Future of the result. Several DB rows
+# can point at the same page or product ID (and Reliance Digital fetches its page once per
+# pincode for the price), so each one is requested once per run. Cleared at the start of main_logic().
+_RUN_FETCHES = {}
+_RUN_FETCHES_LOCK = threading.Lock()
+
+def fetch_once(key, fetch, *args):
+    """Returns fetch(*args), calling it once per key per run; concurrent callers wait for the first."""
+    with _RUN_FETCHES_LOCK:
+        future = _RUN_FETCHES.get(key)
+        owner = future is None
+        if owner:
+            future = _RUN_FETCHES[key] = Future()
+    if owner:
+        try:
+            future.set_result(fetch(*args))
+        except Exception as e:
+            future.set_exception(e)
+    return future.result()
+
+def post_json(url, payload, headers=JSON_HEADERS, read_timeout=10):
+    """POSTs payload as JSON and returns (status code, body bytes)."""
+    res = SESSION.post(url, data=orjson.dumps(payload), headers=headers, timeout=(CONNECT_TIMEOUT, read_timeout))
+    return res.status_code, res.content
+
+def get_page(url, headers=None, read_timeout=20):
+    """GETs a page and returns (status code, body bytes)."""
+    res = SESSION.get(url, headers=headers, timeout=(CONNECT_TIMEOUT, read_timeout))
+    return res.status_code, res.content
+
+class CheckFailed(Exception):
+    """Raised by a checker (after logging the cause) when it got no answer, so the miss isn't cached."""
+
 # ==================================
 # 🗄️ DATABASE HELPERS
 # ==================================
 
+# Connections are pooled per process so warm invocations skip the TCP/TLS/auth handshake.
+_DB_POOL = None
+_DB_POOL_LOCK = threading.Lock()
+
+def get_db_pool():
+    """Returns the process-wide psycopg2 pool for DIRECT_URL, creating it on first use."""
+    global _DB_POOL
+    if _DB_POOL is None:
+        if not DATABASE_URL:
+            raise Exception("DATABASE_URL environment variable is not set.")
+        with _DB_POOL_LOCK:
+            if _DB_POOL is None:
+                # Imported here so cold starts that never reach the DB (e.g. a 401) skip loading libpq
+                import psycopg2.pool
+                # Set timezone awareness for datetime objects once per connection (startup option)
+                _DB_POOL = psycopg2.pool.ThreadedConnectionPool(
+                    minconn=1, maxconn=4, dsn=DATABASE_URL, options="-c timezone=UTC"
+                )
+    return _DB_POOL
+
+@contextmanager
 def get_db_connection():
-    """Returns a new psycopg2 connection configured for DIRECT_URL."""
-    if not DATABASE_URL:
-        raise Exception("DATABASE_URL environment variable is not set.")
-    # Set timezone awareness for datetime objects
-    conn = psycopg2.connect(DATABASE_URL)
-    conn.cursor().execute("SET timezone TO 'UTC'")
-    return conn
+    """Borrows a pooled connection configured for DIRECT_URL and hands it back afterwards."""
+    import psycopg2
+    pool = get_db_pool()
+    conn = pool.getconn()
+    try:
+        # psycopg2 only flags conn.closed after an operation fails, so a connection the server
+        # dropped while the process sat frozen looks healthy until used: probe it once here
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # Connection-level failure: don't hand this connection to the next invocation
+        discard = True
+        raise
+    finally:
+        # putconn() rolls back anything left uncommitted before the connection is reused
+        pool.putconn(conn, close=discard or bool(conn.closed))
 
 def get_license_info():
     """Retrieves the local license validity date from the database."""
-    print("[info] LICENSING: Fetching local license info...")
+    log.info("[info] LICENSING: Fetching local license info...")
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Query the 'licenses' table (mapped from ClientLicense model)
-        cursor.execute(
-            "SELECT valid_until FROM licenses WHERE client_id = %s",
-            (CLIENT_ID,)
-        )
-        result = cursor.fetchone()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Query the 'licenses' table (mapped from ClientLicense model)
+            cursor.execute(
+                "SELECT valid_until FROM licenses WHERE client_id = %s",
+                (CLIENT_ID,)
+            )
+            result = cursor.fetchone()
     except Exception as e:
-        print(f"[error] LICENSING: Database read error (Did you run the Prisma migration?): {e}")
+        log.error("[error] LICENSING: Database read error (Did you run the Prisma migration?): %s", e)
         return None
     
     if result:
-        # returns the datetime object, implicitly UTC due to SET timezone above
+        # returns the datetime object, implicitly UTC via the pool's -c timezone=UTC startup option
         valid_until = result[0].replace(tzinfo=datetime.timezone.utc)
-        print(f"[info] LICENSING: Found local license valid until {valid_until.isoformat()}")
+        log.info("[info] LICENSING: Found local license valid until %s", valid_until.isoformat())
         return valid_until
     
-    print("[info] LICENSING: No existing local license found in DB.")
+    log.info("[info] LICENSING: No existing local license found in DB.")
     return None
 
 def update_license_info(new_valid_until):
@@ -76,44 +253,60 @@ def update_license_info(new_valid_until):
     if new_valid_until.tzinfo is None:
          new_valid_until = new_valid_until.replace(tzinfo=datetime.timezone.utc)
          
-    print(f"[info] LICENSING: Updating local license to {new_valid_until.isoformat()}...")
+    log.info("[info] LICENSING: Updating local license to %s...", new_valid_until.isoformat())
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Use UPSERT logic (INSERT ON CONFLICT UPDATE) for PostgreSQL
-        # This inserts if the client_id is new, or updates if it already exists.
-        cursor.execute(
-            """
-            INSERT INTO licenses (client_id, license_key, valid_until) 
-            VALUES (%s, %s, %s)
-            ON CONFLICT (client_id) 
-            DO UPDATE SET valid_until = EXCLUDED.valid_until, license_key = EXCLUDED.license_key
-            """,
-            (CLIENT_ID, LICENSE_KEY, new_valid_until)
-        )
-        conn.commit()
-        conn.close()
-        print("[info] ✅ LICENSING: Local license successfully updated/extended.")
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Use UPSERT logic (INSERT ON CONFLICT UPDATE) for PostgreSQL
+            # This inserts if the client_id is new, or updates if it already exists.
+            cursor.execute(
+                """
+                INSERT INTO licenses (client_id, license_key, valid_until) 
+                VALUES (%s, %s, %s)
+                ON CONFLICT (client_id) 
+                DO UPDATE SET valid_until = EXCLUDED.valid_until, license_key = EXCLUDED.license_key
+                """,
+                (CLIENT_ID, LICENSE_KEY, new_valid_until)
+            )
+            conn.commit()
+        log.info("[info] ✅ LICENSING: Local license successfully updated/extended.")
     except Exception as e:
-        print(f"[error] LICENSING: Failed to update local license: {e}")
+        log.error("[error] LICENSING: Failed to update local license: %s", e)
 
 # ==================================
 # 🔑 LICENSE CHECKER (DB CACHE + REMOTE REFRESH)
 # ==================================
+# In-process copy of the last known validity, reused by warm invocations.
+_LICENSE_CACHE = {"valid_until": None, "checked_at": 0}
+
+def remember_license(valid_until):
+    """Stores a confirmed validity date in the in-process license cache."""
+    _LICENSE_CACHE["valid_until"] = valid_until
+    _LICENSE_CACHE["checked_at"] = time.monotonic()
+
 def check_license():
     """
-    Checks the local DB cache first. If near expiry, calls the remote server 
-    to validate and extend the local license.
+    Checks the in-process cache, then the local DB cache. If near expiry, calls
+    the remote server to validate and extend the local license.
     """
     now = datetime.datetime.now(datetime.timezone.utc)
     
     # 1. Input/Config Check
     if not all([LICENSE_SERVER_URL, CLIENT_ID, LICENSE_KEY]):
-        print("[error] ❌ LICENSING: Missing required environment variables (LICENSE_SERVER_URL, CLIENT_ID, LICENSE_KEY). Cannot proceed.")
+        log.error("[error] ❌ LICENSING: Missing required environment variables (LICENSE_SERVER_URL, CLIENT_ID, LICENSE_KEY). Cannot proceed.")
         return False
+
+    # 2. Check in-process cache (skips the DB round-trip on warm invocations)
+    cached_valid_until = _LICENSE_CACHE["valid_until"]
+    if (
+        cached_valid_until
+        and time.monotonic() - _LICENSE_CACHE["checked_at"] < LICENSE_MEMORY_CACHE_SECONDS
+        and (cached_valid_until - now).days >= MIN_REFRESH_INTERVAL_DAYS
+    ):
+        return True
         
-    # 2. Check local database cache
+    # 3. Check local database cache
     local_valid_until = get_license_info()
     
     remote_check_needed = True
@@ -128,17 +321,18 @@ def check_license():
         # If time_left is negative (already expired), remote_check_needed remains True
 
     if not remote_check_needed:
+        remember_license(local_valid_until)
         return True # Local license is valid and sufficiently far from expiry
 
-    # 3. Perform remote check
+    # 4. Perform remote check
     payload = {
         "client_id": CLIENT_ID,
         "license_key": LICENSE_KEY,
     }
 
     try:
-        print("[info] 🔑 LICENSING: Performing remote validation...")
-        res = requests.post(LICENSE_SERVER_URL, json=payload, timeout=10)
+        log.info("[info] 🔑 LICENSING: Performing remote validation...")
+        res = SESSION.post(LICENSE_SERVER_URL, data=orjson.dumps(payload), headers=JSON_HEADERS, timeout=(CONNECT_TIMEOUT, 10))
 
         if res.status_code == 200:
             # Success! Extend the local expiry date.
@@ -154,33 +348,34 @@ def check_license():
             # but we trust the 200 status code to proceed.
             
             update_license_info(new_valid_until)
+            remember_license(new_valid_until)
             return True
 
         elif res.status_code == 403:
             # Remote server rejects the license (expired/invalid)
-            data = res.json()
+            data = orjson.loads(res.content)
             error_msg = data.get("error", "Subscription expired or invalid key.")
-            print(f"[error] ❌ LICENSING: Remote check rejected: {error_msg}")
+            log.error("[error] ❌ LICENSING: Remote check rejected: %s", error_msg)
             
             # Crucially, we do NOT extend or update the local DB.
             return False
             
         else:
-            print(f"[error] ❌ LICENSING: Server returned status code {res.status_code}. Response: {res.text}")
+            log.error("[error] ❌ LICENSING: Server returned status code %s. Response: %s", res.status_code, res.text)
             return False
 
     except requests.exceptions.RequestException as e:
-        print(f"[error] ❌ LICENSING: Failed to connect to licensing server: {e}")
+        log.error("[error] ❌ LICENSING: Failed to connect to licensing server: %s", e)
         
         # Server is unreachable. Check if we can rely on an unexpired local license.
         if local_valid_until and local_valid_until > now:
-             print("[warn] ⚠️ LICENSING: Connection failed, but using *unexpired* local DB license cache.")
+             log.warning("[warn] ⚠️ LICENSING: Connection failed, but using *unexpired* local DB license cache.")
              return True
              
-        print("[error] ❌ LICENSING: Connection failed and local license is expired or missing. Cannot proceed.")
+        log.error("[error] ❌ LICENSING: Connection failed and local license is expired or missing. Cannot proceed.")
         return False
     except Exception as e:
-        print(f"[error] ❌ LICENSING: An unexpected error occurred during remote check: {e}")
+        log.error("[error] ❌ LICENSING: An unexpected error occurred during remote check: %s", e)
         return False
 
 # ==================================
@@ -190,21 +385,19 @@ class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         query_components = parse_qs(urlparse(self.path).query)
         auth_key = query_components.get("secret", [None])[0]
+        # ?nocache=1 forces fresh store checks (debugging)
+        use_cache = query_components.get("nocache", ["0"])[0] != "1"
 
         if auth_key != CRON_SECRET:
             self.send_response(401)
             self.send_header("Content-type", "application/json")
             self.end_headers()
-            self.wfile.write(json.dumps({"error": "Unauthorized"}).encode())
+            self.wfile.write(orjson.dumps({"error": "Unauthorized"}))
             return
 
         try:
-            # Check License before proceeding 
-            if not check_license():
-                # Raise an exception if the license check fails
-                raise Exception("License check failed. Terminating operation.")
-                
-            in_stock_messages, summary = main_logic()
+            # main_logic() verifies the license (alongside the product fetch) before checking stock
+            in_stock_messages, summary = main_logic(use_cache=use_cache)
 
             # ✅ Only send Telegram message if at least one product is available
             if in_stock_messages:
@@ -215,18 +408,18 @@ class handler(BaseHTTPRequestHandler):
                     + summary
                 )
                 send_telegram_message(final_message)
-                print("[info] ✅ Telegram message sent with available products.")
+                log.info("[info] ✅ Telegram message sent with available products.")
             else:
-                print("[info] ❌ No products in stock — skipping Telegram notification.")
+                log.info("[info] ❌ No products in stock — skipping Telegram notification.")
 
             # ✅ Always respond with summary
             self.send_response(200)
             self.send_header("Content-type", "application/json")
             self.end_headers()
             self.wfile.write(
-                json.dumps(
+                orjson.dumps(
                     {"status": "ok", "found": len(in_stock_messages), "summary": summary}
-                ).encode()
+                )
             )
 
         except Exception as e:
@@ -239,40 +432,82 @@ class handler(BaseHTTPRequestHandler):
                 
             self.send_header("Content-type", "application/json")
             self.end_headers()
-            self.wfile.write(json.dumps({"error": error_message}).encode())
+            self.wfile.write(orjson.dumps({"error": error_message}))
 
 # ==================================
-# 🗄️ DATABASE (Product query uses get_db_connection now)
+# 🗄️ DATABASE (Product query uses the pooled get_db_connection)
 # ==================================
+# In-process copy of the product list, reused by warm invocations.
+_PRODUCTS_CACHE = {"products": None, "loaded_at": 0}
+
 def get_products_from_db():
-    print("[info] Connecting to database...")
-    # NOTE: psycopg2 should be installed if running this locally: pip install psycopg2-binary
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    use_cache = RECHECK_INTERVAL_MINUTES <= 0 and PRODUCTS_CACHE_SECONDS > 0
+    if (
+        use_cache
+        and _PRODUCTS_CACHE["products"] is not None
+        and time.monotonic() - _PRODUCTS_CACHE["loaded_at"] < PRODUCTS_CACHE_SECONDS
+    ):
+        log.info("[info] Using cached product list (%s products).", len(_PRODUCTS_CACHE['products']))
+        return _PRODUCTS_CACHE["products"]
+
+    log.info("[info] Connecting to database...")
     # Ensure the query selects all necessary columns, including affiliate_link
-    cursor.execute("SELECT name, url, product_id, store_type, affiliate_link FROM products")
-    products = cursor.fetchall()
-    conn.close()
-
-    products_list = [
-        {
-            "name": row[0],
-            "url": row[1],
-            "productId": row[2],
-            "storeType": row[3],
-            "affiliateLink": row[4],
-        }
-        for row in products
-    ]
-    print(f"[info] Loaded {len(products_list)} products from database.")
+    query = "SELECT id, name, url, product_id, store_type, affiliate_link FROM products"
+    params = ()
+    if RECHECK_INTERVAL_MINUTES > 0:
+        # Only pick up rows that are due, stalest first, so big catalogs are spread over runs
+        query += (
+            " WHERE last_checked_at IS NULL"
+            " OR last_checked_at < NOW() - make_interval(mins => %s)"
+            " ORDER BY last_checked_at NULLS FIRST LIMIT %s"
+        )
+        params = (RECHECK_INTERVAL_MINUTES, RECHECK_BATCH_SIZE)
+
+    # NOTE: psycopg2 should be installed if running this locally: pip install psycopg2-binary
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        # Build the dicts straight off the cursor instead of materializing fetchall() first
+        products_list = [
+            {
+                "id": row[0],
+                "name": row[1],
+                "url": row[2],
+                "productId": row[3],
+                "storeType": row[4],
+                "affiliateLink": row[5],
+                # What alerts link to: the affiliate link when there is one
+                "link": row[5] or row[2],
+            }
+            for row in cursor
+        ]
+    log.info("[info] Loaded %s products from database.", len(products_list))
+    if use_cache:
+        _PRODUCTS_CACHE["products"] = products_list
+        _PRODUCTS_CACHE["loaded_at"] = time.monotonic()
     return products_list
 
+def mark_products_checked(product_ids):
+    """Stamps last_checked_at on the given products so the next run skips them until they're due."""
+    if not product_ids:
+        return
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE products SET last_checked_at = NOW() WHERE id = ANY(%s)",
+                (list(product_ids),)
+            )
+            conn.commit()
+    except Exception as e:
+        log.error("[error] Failed to update last_checked_at: %s", e)
+
 # ==================================
 # 💬 TELEGRAM MESSAGE
 # ==================================
 def send_telegram_message(message):
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_GROUP_ID:
-        print("[warn] Missing Telegram config.")
+        log.warning("[warn] Missing Telegram config.")
         return
 
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
@@ -284,94 +519,101 @@ def send_telegram_message(message):
     }
 
     try:
-        res = requests.post(url, json=payload, timeout=10)
+        res = SESSION.post(url, data=orjson.dumps(payload), headers=JSON_HEADERS, timeout=(CONNECT_TIMEOUT, 10))
         if res.status_code == 200:
-            print(f"[info] ✅ Message sent to group {TELEGRAM_GROUP_ID}")
+            log.info("[info] ✅ Message sent to group %s", TELEGRAM_GROUP_ID)
         else:
-            print(f"[warn] Telegram send failed: {res.text}")
+            log.warning("[warn] Telegram send failed: %s", res.text)
     except Exception as e:
-        print(f"[error] Telegram error: {e}")
+        log.error("[error] Telegram error: %s", e)
+
+def stock_message(store_label, name, link, *details):
+    """Builds one in-stock alert: store heading, linked product name, then any non-empty detail lines."""
+    return "\n".join([f"✅ *{store_label}*", f"[{name}]({link})", *filter(None, details)])
 
 # ==================================
 # 🦄 UNICORN CHECKER (iPhone 17, 256GB)
 # ==================================
-def check_unicorn():
-    """Checks stock for all iPhone 17 (256GB) variants at Unicorn Store."""
-    
-    # --- API CONFIG ---
-    BASE_URL = "https://fe01.beamcommerce.in/get_product_by_option_id"
-    HEADERS = {
-        "accept": "application/json, text/plain, */*",
-        "content-type": "application/json",
-        "customer-id": "unicorn",
-        "origin": "https://shop.unicornstore.in",
-        "referer": "https://shop.unicornstore.in/",
-    }
-    
-    # Fixed product attributes for iPhone 17 (Category 456)
-    CATEGORY_ID = "456" 
-    FAMILY_ID = "94"
-    GROUP_IDS = "57,58"
-    STORAGE_256GB_ID = "250" # 256GB Option ID 
-
-    # Color variants to check (ID 57)
-    COLOR_VARIANTS = {
-        "Lavender": "313",
-        "Sage": "311",
-        "Mist Blue": "312",
-        "White": "314",
-        "Black": "315",
+UNICORN_URL = "https://fe01.beamcommerce.in/get_product_by_option_id"
+UNICORN_HEADERS = {
+    "accept": "application/json, text/plain, */*",
+    "content-type": "application/json",
+    "customer-id": "unicorn",
+    "origin": "https://shop.unicornstore.in",
+    "referer": "https://shop.unicornstore.in/",
+}
+
+# Fixed product attributes for iPhone 17 (Category 456)
+UNICORN_CATEGORY_ID = "456"
+UNICORN_FAMILY_ID = "94"
+UNICORN_GROUP_IDS = "57,58"
+UNICORN_STORAGE_256GB_ID = "250" # 256GB Option ID
+
+# Color variants to check (ID 57)
+UNICORN_COLOR_VARIANTS = {
+    "Lavender": "313",
+    "Sage": "311",
+    "Mist Blue": "312",
+    "White": "314",
+    "Black": "315",
+}
+
+# Alerts link to the main product page for every variant
+UNICORN_PRODUCT_URL = "https://shop.unicornstore.in/iphone-17"
+
+def check_unicorn_variant(color_name, color_id):
+    """Checks stock for one iPhone 17 (256GB) color variant at Unicorn Store."""
+    variant_name = f"iPhone 17 {color_name} 256GB"
+
+    payload = {
+        "category_id": UNICORN_CATEGORY_ID,
+        "family_id": UNICORN_FAMILY_ID,
+        "group_ids": UNICORN_GROUP_IDS,
+        "option_ids": f"{color_id},{UNICORN_STORAGE_256GB_ID}"
     }
-    
-    available_messages = []
-    
-    for color_name, color_id in COLOR_VARIANTS.items():
-        variant_name = f"iPhone 17 {color_name} 256GB"
-        
-        payload = {
-            "category_id": CATEGORY_ID,
-            "family_id": FAMILY_ID,
-            "group_ids": GROUP_IDS,
-            "option_ids": f"{color_id},{STORAGE_256GB_ID}"
-        }
 
-        try:
-            res = requests.post(BASE_URL, headers=HEADERS, json=payload, timeout=10)
-            res.raise_for_status()
-            data = res.json()
-            
-            product_data = data.get("data", {}).get("product", {})
-            quantity = product_data.get("quantity", 0)
-            
-            # Format price and SKU
-            price = f"₹{int(product_data.get('price', 0)):,}" if product_data.get('price') else "N/A"
-            sku = product_data.get("sku", "N/A")
-            
-            # Use the main product page URL for linking
-            product_url = "https://shop.unicornstore.in/iphone-17" 
-            
-            if int(quantity) > 0:
-                print(f"[UNICORN] ✅ {variant_name} is IN STOCK ({quantity} units)")
-                message = (
-                    f"✅ *Unicorn*\n"
-                    f"[{variant_name} - {sku}]({product_url})"
-                    f"\n💰 Price: {price}, Qty: {quantity}"
-                )
-                available_messages.append(message)
-            else:
-                dispatch_note = product_data.get("custom_column_4", "Out of Stock").strip()
-                print(f"[UNICORN] ❌ {variant_name} unavailable: {dispatch_note}")
-                
-        except Exception as e:
-            print(f"[error] Unicorn check failed for {variant_name}: {e}")
-    
-    return available_messages
+    try:
+        res = SESSION.post(UNICORN_URL, headers=UNICORN_HEADERS, data=orjson.dumps(payload), timeout=(CONNECT_TIMEOUT, 10))
+        res.raise_for_status()
+        data = orjson.loads(res.content)
+
+        product_data = data.get("data", {}).get("product", {})
+        quantity = int(product_data.get("quantity") or 0)
+
+        # Out of stock is the common case: bail before formatting anything
+        if quantity <= 0:
+            dispatch_note = product_data.get("custom_column_4", "Out of Stock").strip()
+            log.info("[UNICORN] ❌ %s unavailable: %s", variant_name, dispatch_note)
+            return None
+
+        # Format price and SKU
+        price_value = product_data.get("price")
+        price = f"₹{int(price_value):,}" if price_value else "N/A"
+        sku = product_data.get("sku", "N/A")
+
+        log.info("[UNICORN] ✅ %s is IN STOCK (%s units)", variant_name, quantity)
+        return stock_message(
+            "Unicorn", f"{variant_name} - {sku}", UNICORN_PRODUCT_URL, f"💰 Price: {price}, Qty: {quantity}"
+        )
+
+    except Exception as e:
+        log.error("[error] Unicorn check failed for %s: %s", variant_name, e)
+        raise CheckFailed(variant_name) from e
 
 # ==================================
 # 🛒 CROMA CHECKER
 # ==================================
+CROMA_URL = "https://api.croma.com/inventory/oms/v2/tms/details-pwa/"
+CROMA_HEADERS = {
+    "accept": "application/json",
+    "content-type": "application/json",
+    "oms-apim-subscription-key": "1131858141634e2abe2efb2b3a2a2a5d",
+    "origin": "https://www.croma.com",
+    "referer": "https://www.croma.com/",
+}
+
 def check_croma(product, pincode):
-    url = "https://api.croma.com/inventory/oms/v2/tms/details-pwa/"
+    """Checks Croma home delivery for one pincode via the promise API."""
     payload = {
         "promise": {
             "allocationRuleID": "SYSTEM",
@@ -392,33 +634,39 @@ def check_croma(product, pincode):
             },
         }
     }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "oms-apim-subscription-key": "1131858141634e2abe2efb2b3a2a2a5d",
-        "origin": "https://www.croma.com",
-        "referer": "https://www.croma.com/",
-    }
 
     try:
-        res = requests.post(url, headers=headers, json=payload, timeout=10)
-        data = res.json()
-
-        lines = (
-            data.get("promise", {})
-            .get("suggestedOption", {})
-            .get("option", {})
-            .get("promiseLines", {})
-            .get("promiseLine", [])
+        status_code, body = fetch_once(
+            ("croma", product["productId"], pincode), post_json, CROMA_URL, payload, CROMA_HEADERS
         )
+        # Before the fast path: an expired subscription key (401), a 5xx or an HTML error
+        # page has no promiseLine either and must not pass for "unavailable"
+        if status_code >= 400:
+            raise requests.HTTPError(f"{status_code} from promise API")
+
+        # Fast path: without any promiseLine key the product can't be deliverable,
+        # so skip decoding the (common) out-of-stock response entirely.
+        if b'"promiseLine"' not in body:
+            log.info("[CROMA] ❌ %s unavailable at %s", product['name'], pincode)
+            return None
 
+        data = orjson.loads(body)
+
+        try:
+            lines = data["promise"]["suggestedOption"]["option"]["promiseLines"]["promiseLine"]
+        except (KeyError, TypeError):
+            # No suggested option (or a null level) means nothing is deliverable
+            lines = None
+
+        # Truthiness only: a single suggested line may come back as an object rather than a list
         if lines:
-            print(f"[CROMA] ✅ {product['name']} deliverable to {pincode}")
-            return f"✅ *Croma*\n[{product['name']}]({product['affiliateLink'] or product['url']})"
+            log.info("[CROMA] ✅ %s deliverable to %s", product['name'], pincode)
+            return stock_message("Croma", product["name"], product["link"])
 
-        print(f"[CROMA] ❌ {product['name']} unavailable at {pincode}")
+        log.info("[CROMA] ❌ %s unavailable at %s", product['name'], pincode)
     except Exception as e:
-        print(f"[error] Croma check failed for {product['name']}: {e}")
+        log.error("[error] Croma check failed for %s: %s", product['name'], e)
+        raise CheckFailed(product['name']) from e
     return None
 
 # ==================================
@@ -428,101 +676,141 @@ def check_flipkart(product, pincode="132001"):
     """Call Flipkart via AlwaysData proxy."""
     try:
         payload = {"productId": product["productId"], "pincode": pincode}
-        res = requests.post(FLIPKART_PROXY_URL, json=payload, timeout=25)
+        status_code, body = fetch_once(
+            ("flipkart", product["productId"], pincode), post_json, FLIPKART_PROXY_URL, payload, JSON_HEADERS, 25
+        )
+
+        if status_code != 200:
+            log.info("[FLIPKART] ⚠️ Proxy failed (%s) for %s", status_code, product['name'])
+            raise CheckFailed(product['name'])
 
-        if res.status_code != 200:
-            print(f"[FLIPKART] ⚠️ Proxy failed ({res.status_code}) for {product['name']}")
+        # Fast path: "available" can only be true if a JSON true appears somewhere
+        if b"true" not in body:
+            log.info("[FLIPKART] ❌ %s not deliverable at %s", product['name'], pincode)
             return None
 
-        data = res.json()
+        data = orjson.loads(body)
         response = data.get("RESPONSE", {}).get(product["productId"], {})
         listing = response.get("listingSummary", {})
         available = listing.get("available", False)
 
         if available:
             price = listing.get("pricing", {}).get("finalPrice", {}).get("decimalValue", None)
-            print(f"[FLIPKART] ✅ {product['name']} deliverable to {pincode}")
-            return (
-                f"✅ *Flipkart*\n[{product['name']}]({product['affiliateLink'] or product['url']})"
-                + (f"\n💰 Price: ₹{price}" if price else "")
-            )
+            log.info("[FLIPKART] ✅ %s deliverable to %s", product['name'], pincode)
+            return stock_message("Flipkart", product["name"], product["link"], price and f"💰 Price: ₹{price}")
 
-        print(f"[FLIPKART] ❌ {product['name']} not deliverable at {pincode}")
+        log.info("[FLIPKART] ❌ %s not deliverable at %s", product['name'], pincode)
         return None
 
+    except CheckFailed:
+        raise
     except Exception as e:
-        print(f"[error] Flipkart proxy check failed for {product['name']}: {e}")
-        return None
+        log.error("[error] Flipkart proxy check failed for %s: %s", product['name'], e)
+        raise CheckFailed(product['name']) from e
 
 # ==================================
 # 🧾 AMAZON HTML PARSER CHECKER
 # ==================================
+AMAZON_HEADERS = {
+    "authority": "www.amazon.in",
+    "method": "GET",
+    "scheme": "https",
+    "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "accept-language": "en-US,en;q=0.9",
+    "cache-control": "max-age=0",
+    "sec-ch-ua": '"Not_A Brand";v="99", "Google Chrome";v="137", "Chromium";v="137"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+    "upgrade-insecure-requests": "1",
+}
+
+# Amazon's stable element ids, matched straight on the response bytes (no DOM build)
+AMAZON_TITLE_RE = re.compile(rb'id="productTitle"[^>]*>\s*([^<]+)')
+AMAZON_PRICE_RE = re.compile(rb'class="a-price[^"]*"[^>]*>\s*<span class="a-offscreen">([^<]+)')
+# First text inside the first <span> of the availability block (what "#availability span" read):
+# the search stays inside the block's <div>, and tags nested in the span are skipped over.
+# The skip group repeats single \s (not \s+) so a blank span fails in linear time, not exponential.
+AMAZON_AVAILABILITY_RE = re.compile(
+    rb'id="availability"(?:(?!</div>)[\s\S])*?<span[^>]*>(?:\s|<(?!/div)[^>]*>)*([^<\s][^<]*)', re.I
+)
+# Phrases in the availability text that mean the item can be bought. "available" is
+# word-anchored so "currently unavailable" no longer counts as in stock.
+AMAZON_AVAILABLE_RE = re.compile(r"in stock|free delivery|delivery by|usually dispatched|get it by|\bavailable")
+
+def read_until_markers(res, markers, tail=4096, chunk_size=16384):
+    """
+    Streams a response body until every marker has been seen (plus `tail` bytes
+    after, so the element's content is included) or the body ends.
+    """
+    body = bytearray()
+    pending = set(markers)
+    stop_at = None
+    for chunk in res.iter_content(chunk_size):
+        # Re-scan a little of the previous chunk in case a marker straddles the boundary
+        scan_from = max(0, len(body) - 64)
+        body += chunk
+        if pending:
+            pending = {marker for marker in pending if body.find(marker, scan_from) < 0}
+            if not pending:
+                stop_at = len(body) + tail
+        if stop_at is not None and len(body) >= stop_at:
+            break
+    return bytes(body)
+
+def match_text(pattern, body):
+    """Returns the first capture group of a bytes regex as clean text, or None."""
+    match = pattern.search(body)
+    if not match:
+        return None
+    return html.unescape(match.group(1).decode("utf-8", "replace")).strip()
+
+def fetch_amazon_page(url):
+    """Returns the head of an Amazon product page, up to just past the availability block."""
+    # Stream the page and hang up once title + availability have arrived;
+    # the rest is reviews/recommendations we never look at.
+    with SESSION.get(url, headers=AMAZON_HEADERS, timeout=(CONNECT_TIMEOUT, 20), stream=True) as res:
+        log.info("[AMAZON] Status code: %s", res.status_code)
+        # An error/robot-check page has no availability block and would read as out of stock
+        res.raise_for_status()
+        return read_until_markers(res, (b'id="productTitle"', b'id="availability"'))
+
 def check_amazon(product):
     """Check stock availability by scraping the Amazon product page."""
     url = product["url"]
-    print(f"[AMAZON] Checking: {url}")
-
-    headers = {
-        "authority": "www.amazon.in",
-        "method": "GET",
-        "scheme": "https",
-        "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "accept-language": "en-US,en;q=0.9",
-        "cache-control": "max-age=0",
-        "sec-ch-ua": '"Not_A Brand";v="99", "Google Chrome";v="137", "Chromium";v="137"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"Windows"',
-        "upgrade-insecure-requests": "1",
-        "user-agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/137.0.0.0 Safari/537.36"
-        ),
-    }
+    log.info("[AMAZON] Checking: %s", url)
 
     try:
-        res = requests.get(url, headers=headers, timeout=20)
-        print(f"[AMAZON] Status code: {res.status_code}")
-        html = res.text
-        soup = BeautifulSoup(html, "html.parser")
-
-        title_el = soup.select_one("#productTitle")
-        price_el = soup.select_one(".a-price .a-offscreen")
-        availability_el = soup.select_one("#availability span")
-
-        title = title_el.get_text(strip=True) if title_el else product["name"]
-        price = price_el.get_text(strip=True) if price_el else None
-        availability = availability_el.get_text(strip=True).lower() if availability_el else ""
-
-        available_phrases = [
-            "in stock",
-            "free delivery",
-            "delivery by",
-            "usually dispatched",
-            "get it by",
-            "available",
-        ]
-        available = any(phrase in availability for phrase in available_phrases)
+        body = fetch_once(("amazon", url), fetch_amazon_page, url)
+
+        title = match_text(AMAZON_TITLE_RE, body) or product["name"]
+        price = match_text(AMAZON_PRICE_RE, body)
+        availability = (match_text(AMAZON_AVAILABILITY_RE, body) or "").lower()
+
+        available = AMAZON_AVAILABLE_RE.search(availability) is not None
 
         if available:
-            print(f"[AMAZON] ✅ {title} is available at {price}")
-            return (
-                f"✅ *Amazon*\n"
-                f"[{title}]({product['affiliateLink'] or url})"
-                + (f"\n💰 {price}" if price else "")
-            )
+            log.info("[AMAZON] ✅ %s is available at %s", title, price)
+            return stock_message("Amazon", title, product["link"], price and f"💰 {price}")
         else:
-            print(f"[AMAZON] ❌ {title} appears unavailable.")
-            print(f"[debug] Availability text: '{availability}'")
+            log.info("[AMAZON] ❌ %s appears unavailable.", title)
+            log.debug("[debug] Availability text: '%s'", availability)
             return None
 
     except Exception as e:
-        print(f"[error] Amazon HTML check failed for {product['name']}: {e}")
-        return None
+        log.error("[error] Amazon HTML check failed for %s: %s", product['name'], e)
+        raise CheckFailed(product['name']) from e
 
 # ==================================
 # 🌐 RELIANCE DIGITAL API CHECKER (MODIFIED TO USE DB ID)
 # ==================================
+RD_INVENTORY_URL = "https://www.reliancedigital.in/ext/raven-api/inventory/multi/articles-v2"
+RD_HEADERS = {
+    "accept": "application/json, text/plain, */*",
+    "content-type": "application/json",
+    "origin": "https://www.reliancedigital.in",
+    "referer": "https://www.reliancedigital.in/",
+}
+
 def check_reliance_digital(product, pincode):
     """
     Check stock availability for a Reliance Digital product by querying the 
@@ -534,23 +822,13 @@ def check_reliance_digital(product, pincode):
     article_id = product["productId"] 
     
     if not article_id:
-        print(f"[RD] ❌ Cannot check {name}: Missing internal Article ID.")
+        log.info("[RD] ❌ Cannot check %s: Missing internal Article ID.", name)
         return None
 
     # ----------------------------------------
     # STEP 2: Check Stock using the Article ID
     # ----------------------------------------
-    print(f"[RD] Checking stock: {name} (ID: {article_id}) for Pincode {pincode}")
-
-    inventory_url = "https://www.reliancedigital.in/ext/raven-api/inventory/multi/articles-v2"
-    
-    inventory_headers = {
-        "accept": "application/json, text/plain, */*",
-        "content-type": "application/json",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
-        "origin": "https://www.reliancedigital.in",
-        "referer": "https://www.reliancedigital.in/",
-    }
+    log.info("[RD] Checking stock: %s (ID: %s) for Pincode %s", name, article_id, pincode)
 
     # API Payload 
     payload = {
@@ -562,14 +840,17 @@ def check_reliance_digital(product, pincode):
             }
         ],
         "phone_number": "0",
-        "pincode": str(pincode),
+        "pincode": pincode,
         "request_page": "pdp"
     }
 
     try:
-        res = requests.post(inventory_url, headers=inventory_headers, json=payload, timeout=20)
-        res.raise_for_status() 
-        data = res.json()
+        status_code, body = fetch_once(
+            ("reliance_digital", str(article_id), pincode), post_json, RD_INVENTORY_URL, payload, RD_HEADERS, 20
+        )
+        if status_code >= 400:
+            raise requests.HTTPError(f"{status_code} from inventory API")
+        data = orjson.loads(body)
         
         article_data = data.get("data", {}).get("articles", [])
         if not article_data:
@@ -583,36 +864,70 @@ def check_reliance_digital(product, pincode):
         
         is_in_stock = not (error_type and error_type in ["OutOfStockError", "FaultyArticleError"])
         
-        # Try to extract price from the product page using BS (fallback)
-        price = None
-        try:
-            res_html = requests.get(url, headers=inventory_headers, timeout=10)
-            soup = BeautifulSoup(res_html.text, "html.parser")
-            price_el = soup.select_one('.pdpPrice, .product-price .amount, .final-price, [class*="Price"]')
-            if price_el:
-                # Clean up the price string
-                price = price_el.get_text(strip=True).replace('\n', ' ').replace('₹', '').strip() 
-        except Exception:
-            pass 
-
         if is_in_stock:
-            print(f"[RD] ✅ {name} is IN STOCK at {pincode}.")
-            return (
-                f"✅ *Reliance Digital*\n"
-                f"[{name}]({product['affiliateLink'] or url})"
-                + (f"\n💰 Price: ₹{price}" if price else "")
-            )
+            log.info("[RD] ✅ %s is IN STOCK at %s.", name, pincode)
+
+            # Try to extract price from the product page (fallback). Only the alert shows
+            # the price, so out-of-stock checks skip this second download entirely.
+            price = None
+            try:
+                _, page = fetch_once(("page", url), get_page, url, RD_HEADERS, 10)
+                from selectolax.lexbor import LexborHTMLParser
+                tree = LexborHTMLParser(page)
+                price_el = tree.css_first('.pdpPrice, .product-price .amount, .final-price, [class*="Price"]')
+                if price_el:
+                    # Clean up the price string
+                    price = price_el.text(strip=True).replace('\n', ' ').replace('₹', '').strip() 
+            except Exception:
+                pass 
+
+            return stock_message("Reliance Digital", name, product["link"], price and f"💰 Price: ₹{price}")
         else:
             error_message = article_error.get("message", "Stock Error")
-            print(f"[RD] ❌ {name} is UNAVAILABLE at {pincode}. (Error: {error_message})")
+            log.info("[RD] ❌ %s is UNAVAILABLE at %s. (Error: %s)", name, pincode, error_message)
             return None
 
     except requests.exceptions.RequestException as e:
-        print(f"[error] Reliance Digital inventory check failed for {name}: {e}")
-        return None
+        log.error("[error] Reliance Digital inventory check failed for %s: %s", name, e)
+        raise CheckFailed(name) from e
     except Exception as e:
-        print(f"[error] Reliance Digital check failed for {name} (general): {e}")
-        return None
+        log.error("[error] Reliance Digital check failed for %s (general): %s", name, e)
+        raise CheckFailed(name) from e
+
+# Out-of-stock wording on the iQOO/Vivo product pages, matched against the visible page text
+OUT_OF_STOCK_RE = re.compile(r"out of stock|currently unavailable|notify me", re.I)
+# Never part of the visible text: inline i18n JSON, CSS and notify-me modal templates all
+# carry the phrases above, so they are dropped before scanning
+NON_VISIBLE_TAGS = ["script", "style", "template"]
+
+def says_out_of_stock(tree):
+    """
+    True if the product area's visible text carries out-of-stock wording. Only the main
+    product section is read when the page marks one (header/footer text skipped), else <body>;
+    non-visible tags are stripped from that subtree first.
+    """
+    scope = tree.css_first("main, #product-detail") or tree.body or tree.root
+    scope.strip_tags(NON_VISIBLE_TAGS)
+    return OUT_OF_STOCK_RE.search(scope.text()) is not None
+
+# :lexbor-contains only looks at an element's own text, so the descendant forms catch a
+# "Buy Now" label nested inside the button/link (as soupsieve's :contains() did)
+IQOO_BUY_NOW_SELECTOR = (
+    'button:lexbor-contains("Buy Now"), a:lexbor-contains("Buy Now"), '
+    'button :lexbor-contains("Buy Now"), a :lexbor-contains("Buy Now")'
+)
+
+def find_iqoo_buy_now(tree):
+    """Returns the first <button>/<a> whose full text contains "Buy Now", or None."""
+    node = tree.css_first(IQOO_BUY_NOW_SELECTOR)
+    # A label wrapped in e.g. a <span> matches on the wrapper; step up to its button/link
+    while node is not None and node.tag not in ("button", "a"):
+        node = node.parent
+    if node is not None:
+        return node
+    # Label split across child elements ("Buy <b>Now</b>") is in no single text node: only
+    # then fall back to comparing each button/link's whole text
+    return next((node for node in tree.css("button, a") if "Buy Now" in node.text()), None)
 
 # ==================================
 # 📱 IQOO HTML PARSER CHECKER (MODIFIED)
@@ -620,35 +935,28 @@ def check_reliance_digital(product, pincode):
 def check_iqoo(product):
     """Check stock availability for an iQOO product by scraping its product page."""
     url = product["url"]
-    print(f"[IQOO] Checking: {url}")
-
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/137.0.0.0 Safari/537.36"
-        ),
-    }
+    log.info("[IQOO] Checking: %s", url)
 
     try:
-        res = requests.get(url, headers=headers, timeout=20)
-        html = res.text
-        soup = BeautifulSoup(html, "html.parser")
+        status_code, page = fetch_once(("page", url), get_page, url)
+        if status_code >= 400:
+            raise requests.HTTPError(f"{status_code} from product page")
+        from selectolax.lexbor import LexborHTMLParser
+        tree = LexborHTMLParser(page)
 
         # --- EXTRACT NAME from <title> or fallback ---
-        page_title = soup.find('title')
-        product_name = page_title.get_text(strip=True).split('|')[0].strip() if page_title else product["name"]
+        page_title = tree.css_first('title')
+        product_name = page_title.text(strip=True).split('|')[0].strip() if page_title else product["name"]
         
         # --- KEY SCRAPING LOGIC ---
-        buy_now_button = soup.select_one('button:contains("Buy Now"), a:contains("Buy Now")')
-        out_of_stock_phrases = ["out of stock", "currently unavailable", "notify me"]
-        page_text = soup.get_text().lower()
+        buy_now_button = find_iqoo_buy_now(tree)
         
         is_available = True
         availability_text = "Status indeterminate."
         
         if buy_now_button:
-            is_disabled = buy_now_button.get('disabled') or 'disabled' in buy_now_button.get('class', []) or 'out-of-stock' in buy_now_button.get('class', [])
+            button_classes = (buy_now_button.attributes.get('class') or '').split()
+            is_disabled = 'disabled' in buy_now_button.attributes or 'disabled' in button_classes or 'out-of-stock' in button_classes
             
             if is_disabled:
                 is_available = False
@@ -657,42 +965,37 @@ def check_iqoo(product):
                 is_available = True
                 availability_text = "Active Buy Now button found."
         
-        if not is_available and any(phrase in page_text for phrase in out_of_stock_phrases):
+        # Only scan the page when the button doesn't settle it
+        if (not is_available or not buy_now_button) and says_out_of_stock(tree):
              is_available = False
-             availability_text = "Explicit 'out of stock' phrase found in page text."
-             
-        if not buy_now_button and any(phrase in page_text for phrase in out_of_stock_phrases):
-             is_available = False
-             availability_text = "No clear button, but OOS text found."
+             availability_text = (
+                 "No clear button, but OOS text found." if not buy_now_button
+                 else "Explicit 'out of stock' phrase found in page text."
+             )
 
-        # --- EXTRACT PRICE AND OFFERS ---
-        price_el = soup.select_one('.price-tag, .product-price, .current_price, .selling-price')
-        price = price_el.get_text(strip=True) if price_el else None
-        
-        offer_el = soup.select_one('.product-offers, .discount-details, .emi-details')
-        offers = offer_el.get_text(strip=True) if offer_el else None
-        
-        price_info = ""
-        if price:
-            price_info += f"\n💰 Price: {price}"
-        if offers and len(offers) < 150: # Avoid scraping huge blocks of text
-             price_info += f"\n🎁 Offers: {offers}"
+        if is_available:
+            log.info("[IQOO] ✅ %s is available.", product_name)
 
+            # --- EXTRACT PRICE AND OFFERS (only the alert uses them) ---
+            price_el = tree.css_first('.price-tag, .product-price, .current_price, .selling-price')
+            price = price_el.text(strip=True) if price_el else None
 
-        if is_available:
-            print(f"[IQOO] ✅ {product_name} is available.")
-            return (
-                f"✅ *iQOO*\n"
-                f"[{product_name}]({product['affiliateLink'] or url})"
-                f"{price_info}"
+            offer_el = tree.css_first('.product-offers, .discount-details, .emi-details')
+            offers = offer_el.text(strip=True) if offer_el else None
+
+            return stock_message(
+                "iQOO", product_name, product["link"],
+                price and f"💰 Price: {price}",
+                # Avoid scraping huge blocks of text
+                offers and len(offers) < 150 and f"🎁 Offers: {offers}",
             )
         else:
-            print(f"[IQOO] ❌ {product_name} appears unavailable. ({availability_text})")
+            log.info("[IQOO] ❌ %s appears unavailable. (%s)", product_name, availability_text)
             return None
 
     except Exception as e:
-        print(f"[error] iQOO check failed for {product['name']}: {e}")
-        return None
+        log.error("[error] iQOO check failed for %s: %s", product['name'], e)
+        raise CheckFailed(product['name']) from e
 
 # ==================================
 # 🤳 VIVO HTML PARSER CHECKER (MODIFIED)
@@ -703,36 +1006,28 @@ def check_vivo(product):
     """
     url = product["url"]
     original_name = product["name"]
-    print(f"[VIVO] Checking: {original_name} at {url}")
-
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/137.0.0.0 Safari/537.36"
-        ),
-    }
+    log.info("[VIVO] Checking: %s at %s", original_name, url)
 
     try:
-        res = requests.get(url, headers=headers, timeout=20)
-        print(f"[VIVO] Status code: {res.status_code}")
-        html = res.text
-        soup = BeautifulSoup(html, "html.parser")
+        status_code, page = fetch_once(("page", url), get_page, url)
+        log.info("[VIVO] Status code: %s", status_code)
+        if status_code >= 400:
+            raise requests.HTTPError(f"{status_code} from product page")
+        from selectolax.lexbor import LexborHTMLParser
+        tree = LexborHTMLParser(page)
 
         # --- EXTRACT NAME from <title> or fallback ---
-        page_title = soup.find('title')
-        product_name = page_title.get_text(strip=True).split('|')[0].strip() if page_title else original_name
+        page_title = tree.css_first('title')
+        product_name = page_title.text(strip=True).split('|')[0].strip() if page_title else original_name
 
         # --- KEY SCRAPING LOGIC ---
-        buy_now_link = soup.select_one('a.buyNow, .addToCart, .buyButton')
-        out_of_stock_phrases = ["out of stock", "notify me", "currently unavailable"]
-        page_text_lower = soup.get_text().lower()
+        buy_now_link = tree.css_first('a.buyNow, .addToCart, .buyButton')
         
         is_available = True
         availability_text = "Status indeterminate."
 
         if buy_now_link:
-            is_disabled = 'disabled' in buy_now_link.get('class', [])
+            is_disabled = 'disabled' in (buy_now_link.attributes.get('class') or '').split()
             
             if is_disabled:
                 is_available = False
@@ -741,139 +1036,240 @@ def check_vivo(product):
                 is_available = True
                 availability_text = f"Active Buy Now link found."
         
-        if not is_available and any(phrase in page_text_lower for phrase in out_of_stock_phrases):
+        # Only scan the page when the link doesn't settle it
+        if (not is_available or not buy_now_link) and says_out_of_stock(tree):
              is_available = False
-             availability_text = "Explicit 'out of stock' phrase found in page text."
-             
-        if not buy_now_link and any(phrase in page_text_lower for phrase in out_of_stock_phrases):
-             is_available = False
-             availability_text = "No active Buy Now link found."
+             availability_text = (
+                 "No active Buy Now link found." if not buy_now_link
+                 else "Explicit 'out of stock' phrase found in page text."
+             )
 
-        # --- EXTRACT PRICE AND OFFERS ---
-        price_el = soup.select_one('.price-tag, .product-price, .current_price, .selling-price, .js-final-price')
-        price = price_el.get_text(strip=True) if price_el else None
-        
-        offer_el = soup.select_one('.product-offers, .discount-details, .emi-details')
-        offers = offer_el.get_text(strip=True) if offer_el else None
-        
-        price_info = ""
-        if price:
-            price_info += f"\n💰 Price: {price}"
-        if offers and len(offers) < 150: # Avoid scraping huge blocks of text
-             price_info += f"\n🎁 Offers: {offers}"
+        if is_available:
+            log.info("[VIVO] ✅ %s is available.", product_name)
 
+            # --- EXTRACT PRICE AND OFFERS (only the alert uses them) ---
+            price_el = tree.css_first('.price-tag, .product-price, .current_price, .selling-price, .js-final-price')
+            price = price_el.text(strip=True) if price_el else None
 
-        if is_available:
-            print(f"[VIVO] ✅ {product_name} is available.")
-            return (
-                f"✅ *Vivo*\n"
-                f"[{product_name}]({product['affiliateLink'] or url})"
-                f"{price_info}"
+            offer_el = tree.css_first('.product-offers, .discount-details, .emi-details')
+            offers = offer_el.text(strip=True) if offer_el else None
+
+            return stock_message(
+                "Vivo", product_name, product["link"],
+                price and f"💰 Price: {price}",
+                # Avoid scraping huge blocks of text
+                offers and len(offers) < 150 and f"🎁 Offers: {offers}",
             )
         else:
-            print(f"[VIVO] ❌ {product_name} appears unavailable. ({availability_text})")
+            log.info("[VIVO] ❌ %s appears unavailable. (%s)", product_name, availability_text)
             return None
 
     except Exception as e:
-        print(f"[error] Vivo check failed for {original_name}: {e}")
-        return None
+        log.error("[error] Vivo check failed for %s: %s", original_name, e)
+        raise CheckFailed(original_name) from e
 
 # ==================================
 # 🚀 MAIN LOGIC
 # ==================================
-def main_logic():
-    # --- Check License before proceeding ---
-    if not check_license():
-        # Raise an exception if the license check fails
-        raise Exception("License check failed. Terminating operation.")
-        
+# Recent check results: cache key -> (monotonic timestamp, message or None)
+_STOCK_CACHE = {}
+
+def prune_stock_cache():
+    """Drops expired entries so removed products don't linger in warm processes."""
+    now = time.monotonic()
+    for key, (checked_at, _) in list(_STOCK_CACHE.items()):
+        if now - checked_at >= STOCK_CACHE_SECONDS:
+            _STOCK_CACHE.pop(key, None)
+
+def cached_check(cache_key, use_cache, deadline, check, *args):
+    """
+    Returns a fresh cached result for cache_key, otherwise runs the check.
+    Only clean answers that arrive before the run's deadline are stored. A failed check
+    raises CheckFailed out of its future: it reads as "not in stock" for this run, but caching
+    it would hide a restock, and the product must not be stamped as checked.
+    """
+    if use_cache and STOCK_CACHE_SECONDS > 0:
+        entry = _STOCK_CACHE.get(cache_key)
+        if entry and time.monotonic() - entry[0] < STOCK_CACHE_SECONDS:
+            return entry[1]
+    if time.time() >= deadline:
+        # Dequeued after the run gave up waiting on it: nobody will read the answer
+        raise CheckFailed("run budget used up")
+    result = check(*args)
+    if time.time() < deadline:
+        _STOCK_CACHE[cache_key] = (time.monotonic(), result)
+    return result
+
+# storeType -> (checker, how it takes pincodes). "each" = one request per pincode,
+# None = not pincode-based.
+# Reliance Digital's productId holds the internal Article ID.
+STORE_CHECKERS = {
+    "croma": (check_croma, "each"),
+    "flipkart": (check_flipkart, "each"),
+    "amazon": (check_amazon, None),
+    "iqoo": (check_iqoo, None),
+    "vivo": (check_vivo, None),
+    "reliance_digital": (check_reliance_digital, "each"),
+}
+
+def submit_product_checks(store_executors, product, deadline, use_cache=True):
+    """Submits every request one DB product needs (one per pincode for pincode-based stores)."""
+    store_type = product["storeType"]
+
+    def submit(check, *args, pincode=None):
+        # Keyed on the DB row (not productId): the message embeds that row's name/link
+        cache_key = (store_type, product["id"], pincode)
+        return store_executors[store_type].submit(cached_check, cache_key, use_cache, deadline, check, *args)
+
+    entry = STORE_CHECKERS.get(store_type)
+    if entry is None:
+        return []
+    check, pincode_mode = entry
+    if pincode_mode == "each":
+        futures = [submit(check, product, pincode, pincode=pincode) for pincode in PINCODES_TO_CHECK]
+
+        def cancel_siblings(done):
+            # One deliverable pincode is enough for the alert: drop the ones still queued
+            if not done.cancelled() and done.exception() is None and done.result():
+                for future in futures:
+                    future.cancel()
+
+        for future in futures:
+            future.add_done_callback(cancel_siblings)
+        return futures
+    return [submit(check, product)]
+
+def settled_result(future):
+    """Returns a finished future's result, or None if it was cancelled, failed or is still running."""
+    if future.done() and not future.cancelled() and future.exception() is None:
+        return future.result()
+    return None
+
+def first_hit(futures):
+    """Returns the first in-stock message from a product's futures (in pincode order), or None."""
+    for future in futures:
+        result = settled_result(future)
+        if result:
+            return result
+    return None
+
+def product_settled(futures):
+    """True once a product's check has an answer: an in-stock hit, or every request finished cleanly."""
+    return first_hit(futures) is not None or all(
+        future.done() and not future.cancelled() and future.exception() is None for future in futures
+    )
+
+def main_logic(use_cache=True):
     start_time = time.time()
-    print("[info] Starting stock check...")
-    products = get_products_from_db()
+    # Results arriving after this are abandoned by the run (see wait() below) and not cached
+    deadline = start_time + RUN_BUDGET_SECONDS
     in_stock = []
+    prune_stock_cache()
+    _RUN_FETCHES.clear()
     
-    # Initialize all counters, including Reliance Digital (RD)
-    croma_count = flip_count = amazon_count = unicorn_count = iqoo_count = vivo_count = rd_count = 0
-    croma_total = flip_total = amazon_total = unicorn_total = iqoo_total = vivo_total = rd_total = 0
-
-    # ----------------------------------------------------
-    # Check Unicorn stock separately for iPhone 17 variants
-    # ----------------------------------------------------
-    unicorn_results = check_unicorn()
-    # We checked 5 variants total (all are 256GB)
-    unicorn_total = 5 
-    unicorn_count = len(unicorn_results)
-    if unicorn_results:
+    executor = ThreadPoolExecutor(max_workers=2)
+    store_executors = {
+        store: ThreadPoolExecutor(max_workers=min(limit, MAX_WORKERS), thread_name_prefix=store)
+        for store, limit in STORE_CONCURRENCY.items()
+    }
+    try:
+        # --- License check and product fetch are independent, so run them side by side ---
+        license_future = executor.submit(check_license)
+        products_future = executor.submit(get_products_from_db)
+        # Both count against the run budget too: a hung DB/license call fails the run instead of the platform timeout
+        _, pending = wait([license_future, products_future], timeout=max(0, deadline - time.time()))
+        if pending:
+            raise Exception("License check / product fetch did not finish within the run budget.")
+        if not license_future.result():
+            # Raise an exception if the license check fails (products are discarded)
+            raise Exception("License check failed. Terminating operation.")
+        products = products_future.result()
+        log.info("[info] Starting stock check...")
+
+        # ----------------------------------------------------
+        # Bucket DB products by store, then fan out Unicorn + every
+        # (product, pincode) request concurrently
+        # ----------------------------------------------------
+        buckets = defaultdict(list)
+        for product in products:
+            buckets[product["storeType"]].append(product)
+
+        # Each Unicorn color is its own request, so they run side by side with everything else
+        unicorn_futures = [
+            store_executors["unicorn"].submit(
+                cached_check, ("unicorn", color_id), use_cache, deadline,
+                check_unicorn_variant, color_name, color_id,
+            )
+            for color_name, color_id in UNICORN_COLOR_VARIANTS.items()
+        ]
+        store_futures = {
+            store_type: [submit_product_checks(store_executors, product, deadline, use_cache) for product in bucket]
+            for store_type, bucket in buckets.items()
+        }
+
+        # Wait for everything only as long as the run budget allows; stragglers
+        # are left behind (and cancelled if they haven't started) below
+        all_futures = unicorn_futures + [
+            future
+            for product_futures in store_futures.values()
+            for futures in product_futures
+            for future in futures
+        ]
+        _, pending = wait(all_futures, timeout=max(0, deadline - time.time()))
+        if pending:
+            log.warning("[warn] Run budget of %ss used up; %s checks left unfinished", RUN_BUDGET_SECONDS, len(pending))
+
+        def collect(store_type):
+            """Reads one store's finished checks; returns (in-stock count, total) and keeps the hits."""
+            results = [first_hit(futures) for futures in store_futures.get(store_type, [])]
+            hits = [result for result in results if result]
+            in_stock.extend(hits)
+            return len(hits), len(results)
+
+        hits, totals = Counter(), Counter()
+
+        # One result per color variant (all are 256GB)
+        unicorn_results = [result for result in (settled_result(future) for future in unicorn_futures) if result]
+        hits["unicorn"], totals["unicorn"] = len(unicorn_results), len(UNICORN_COLOR_VARIANTS)
         in_stock.extend(unicorn_results)
-    
-    # ----------------------------------------------------
-    # Loop through DB products
-    # ----------------------------------------------------
-    for product in products:
-        result = None
-        if product["storeType"] == "croma":
-            croma_total += 1
-            for pincode in PINCODES_TO_CHECK:
-                result = check_croma(product, pincode)
-                if result:
-                    croma_count += 1
-                    in_stock.append(result)
-                    break
-        elif product["storeType"] == "flipkart":
-            flip_total += 1
-            for pincode in PINCODES_TO_CHECK:
-                result = check_flipkart(product, pincode)
-                if result:
-                    flip_count += 1
-                    in_stock.append(result)
-                    break
-        elif product["storeType"] == "amazon":
-            amazon_total += 1
-            result = check_amazon(product)
-            if result:
-                amazon_count += 1
-                in_stock.append(result)
-        elif product["storeType"] == "iqoo":
-            iqoo_total += 1
-            result = check_iqoo(product)
-            if result:
-                iqoo_count += 1
-                in_stock.append(result)
-        elif product["storeType"] == "vivo":
-            vivo_total += 1
-            result = check_vivo(product)
-            if result:
-                vivo_count += 1
-                in_stock.append(result)
-        elif product["storeType"] == "reliance_digital":
-            rd_total += 1
-            # Check RD against all pincodes until a hit is found
-            for pincode in PINCODES_TO_CHECK:
-                # The product['productId'] now contains the internal Article ID
-                result = check_reliance_digital(product, pincode)
-                if result:
-                    rd_count += 1
-                    in_stock.append(result)
-                    break
 
+        # Alerts are grouped per store, in registry order
+        for store_type in STORE_CHECKERS:
+            hits[store_type], totals[store_type] = collect(store_type)
+
+        # Only stamp products whose check actually finished: one cut off by the run budget
+        # must not be skipped for a whole recheck interval without ever being checked
+        checked_ids = [
+            product["id"]
+            for store_type, bucket in buckets.items()
+            for product, futures in zip(bucket, store_futures[store_type])
+            if product_settled(futures)
+        ]
+    finally:
+        # Don't block on hung requests: cancel anything queued and return
+        for pool in (executor, *store_executors.values()):
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    if RECHECK_INTERVAL_MINUTES > 0:
+        mark_products_checked(checked_ids)
 
     duration = round(time.time() - start_time, 2)
     timestamp = datetime.datetime.now().strftime("%d %b %Y %I:%M %p")
 
     # Final Summary (Vivo, iQOO, and RD lines added)
-    summary = (
-        f"🟢 *Croma:* {croma_count}/{croma_total}\n"
-        f"🟣 *Flipkart:* {flip_count}/{flip_total}\n"
-        f"🟡 *Amazon:* {amazon_count}/{amazon_total}\n"
-        f"🦄 *Unicorn:* {unicorn_count}/{unicorn_total} (256GB)\n"
-        f"📱 *iQOO:* {iqoo_count}/{iqoo_total}\n"
-        f"🤳 *Vivo:* {vivo_count}/{vivo_total}\n"
-        f"🌐 *R. Digital:* {rd_count}/{rd_total}\n"
-        f"📦 *Total:* {len(in_stock)} available\n"
-        f"🕒 *Checked:* {timestamp}\n"
-        f"⏱ *Time taken:* {duration}s"
-    )
-
-    print(f"[info] ✅ Found {len(in_stock)} products in stock.")
-    print("[info] Summary:\n" + summary)
+    summary = "\n".join([
+        f"🟢 *Croma:* {hits['croma']}/{totals['croma']}",
+        f"🟣 *Flipkart:* {hits['flipkart']}/{totals['flipkart']}",
+        f"🟡 *Amazon:* {hits['amazon']}/{totals['amazon']}",
+        f"🦄 *Unicorn:* {hits['unicorn']}/{totals['unicorn']} (256GB)",
+        f"📱 *iQOO:* {hits['iqoo']}/{totals['iqoo']}",
+        f"🤳 *Vivo:* {hits['vivo']}/{totals['vivo']}",
+        f"🌐 *R. Digital:* {hits['reliance_digital']}/{totals['reliance_digital']}",
+        f"📦 *Total:* {len(in_stock)} available",
+        f"🕒 *Checked:* {timestamp}",
+        f"⏱ *Time taken:* {duration}s",
+    ])
+
+    log.info("[info] ✅ Found %s products in stock.", len(in_stock))
+    log.info("[info] Summary:\n%s", summary)
     return in_stock, summary
\ No newline at end of file
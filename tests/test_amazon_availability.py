@@ -0,0 +1,55 @@
+import importlib.util
+import os
+import time
+import unittest
+
+# check.py reads its config at import; any pincode will do for parsing tests
+os.environ.setdefault("PINCODES_TO_CHECK", "110001")
+_spec = importlib.util.spec_from_file_location(
+    "check", os.path.join(os.path.dirname(__file__), "..", "api", "check.py")
+)
+check = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(check)
+
+
+def availability(body):
+    return check.match_text(check.AMAZON_AVAILABILITY_RE, body.encode())
+
+
+class AmazonAvailabilityTest(unittest.TestCase):
+    def test_plain_span(self):
+        body = '<div id="availability" class="a-section"> <span class="a-size-medium"> In stock </span></div>'
+        self.assertEqual(availability(body), "In stock")
+
+    def test_nested_span(self):
+        body = (
+            '<div id="availability" class="a-section">\n'
+            '  <span class="a-declarative">\n'
+            '    <span class="a-size-medium a-color-success">In stock</span>\n'
+            '  </span>\n'
+            '</div>'
+        )
+        self.assertEqual(availability(body), "In stock")
+
+    def test_deep_indentation(self):
+        body = '<div id="availability" class="a-section">' + " " * 600 + "\n<span>Currently unavailable.</span></div>"
+        self.assertEqual(availability(body), "Currently unavailable.")
+
+    def test_stays_inside_block(self):
+        body = '<div id="availability" class="a-section"></div><div><span>In stock</span></div>'
+        self.assertIsNone(availability(body))
+
+    def test_blank_span_fails_fast(self):
+        # Whitespace-only span followed by </div>: must not backtrack exponentially
+        body = '<div id="availability" class="a-section"><span>\n' + " " * 40 + "\n    </span>\n</div>"
+        started = time.perf_counter()
+        self.assertIsNone(availability(body))
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+    def test_unavailable_is_not_in_stock(self):
+        text = availability('<div id="availability"><span>Currently unavailable.</span></div>').lower()
+        self.assertIsNone(check.AMAZON_AVAILABLE_RE.search(text))
+
+
+if __name__ == "__main__":
+    unittest.main()